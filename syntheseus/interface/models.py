@@ -1,25 +1,25 @@
 from __future__ import annotations
 
 import math
+import sys
 from abc import abstractmethod
+from dataclasses import dataclass, field, replace
 from typing import Any, Dict, Generic, List, Optional, TypeVar
 
-from pydantic import root_validator
-from pydantic.generics import GenericModel
-
 from syntheseus.interface.bag import Bag
 from syntheseus.interface.molecule import Molecule
 
 InputType = TypeVar("InputType")
 OutputType = TypeVar("OutputType")
 
+# Use `__slots__` for the (potentially very numerous) prediction objects where supported, i.e. from
+# Python 3.10 onwards.
+_DATACLASS_KWARGS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-class Prediction(GenericModel, Generic[InputType, OutputType]):
-    """Reaction prediction from a model, either a forward or a backward one."""
 
-    # Make `pydantic` accept custom types such as `Molecule` or `Bag`.
-    class Config:
-        arbitrary_types_allowed = True
+@dataclass(**_DATACLASS_KWARGS)
+class Prediction(Generic[InputType, OutputType]):
+    """Reaction prediction from a model, either a forward or a backward one."""
 
     # The molecule that the prediction is for and the predicted output:
     input: InputType
@@ -31,49 +31,49 @@ class Prediction(GenericModel, Generic[InputType, OutputType]):
     score: Optional[float] = None  # Any other score.
     reaction: Optional[str] = None  # Reaction smiles.
     rxnid: Optional[int] = None  # Template id, if applicable.
-    metadata: Optional[Dict[str, Any]] = {}  # Additional metadata.
+    metadata: Optional[Dict[str, Any]] = None  # Additional metadata.
+
+    # Probability in both forms, derived once on construction from whichever one was provided; thus,
+    # `probability` and `log_prob` should not be reassigned after construction.
+    _prob: Optional[float] = field(init=False, repr=False, compare=False)
+    _log_prob: Optional[float] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.probability is not None and self.log_prob is not None:
+            raise ValueError(
+                "Probability can be stored as probability or log probability, not both"
+            )
 
-    def get_prob(self) -> float:
         if self.probability is not None:
-            return self.probability
+            self._prob = self.probability
+            self._log_prob = math.log(self.probability) if self.probability != 0.0 else -math.inf
         elif self.log_prob is not None:
-            return math.exp(self.log_prob)
+            self._prob = math.exp(self.log_prob)
+            self._log_prob = self.log_prob
         else:
+            self._prob = self._log_prob = None
+
+    def get_prob(self) -> float:
+        if self._prob is None:
             raise ValueError("Prediction does not have associated probability or log prob value.")
+        return self._prob
 
     def get_log_prob(self) -> float:
-        if self.log_prob is not None:
-            return self.log_prob
-        elif self.probability is not None:
-            return math.log(self.probability)
-        else:
+        if self._log_prob is None:
             raise ValueError("Prediction does not have associated log prob or probability value.")
-
-    @root_validator()
-    def check_at_most_one_source_prob(cls, values):
-        if values.get("probability") is not None and values.get("log_prob") is not None:
-            raise ValueError(
-                "Probability can be stored as probability or log probability, not both"
-            )
-        return values
+        return self._log_prob
 
 
-class PredictionList(GenericModel, Generic[InputType, OutputType]):
+@dataclass(**_DATACLASS_KWARGS)
+class PredictionList(Generic[InputType, OutputType]):
     """Several possible predictions."""
 
-    # Make `pydantic` accept custom types such as `Molecule` or `Bag`.
-    class Config:
-        arbitrary_types_allowed = True
-
     input: InputType
     predictions: List[Prediction[InputType, OutputType]]
-    metadata: Optional[Dict[str, Any]] = {}
+    metadata: Optional[Dict[str, Any]] = None
 
     def truncated(self, num_results: int) -> PredictionList[InputType, OutputType]:
-        fields = self.dict()
-        fields["predictions"] = fields["predictions"][:num_results]
-
-        return PredictionList(**fields)
+        return replace(self, predictions=self.predictions[:num_results])
 
 
 class ReactionModel(Generic[InputType, OutputType]):
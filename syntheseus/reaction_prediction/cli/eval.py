@@ -18,7 +18,7 @@ import logging
 import math
 import os
 import time
-from dataclasses import dataclass, field, fields
+from dataclasses import dataclass, field, fields, replace
 from enum import Enum
 from functools import partial
 from itertools import islice
@@ -224,11 +224,7 @@ def get_results(
                 f"Tried to get {num_results} results, but only got {len(selected_predictions)}"
             )
 
-        batch_outputs.append(
-            PredictionList(
-                input=outputs.input, predictions=selected_predictions, metadata=outputs.metadata
-            )
-        )
+        batch_outputs.append(replace(outputs, predictions=selected_predictions))
 
     if measure_time:
         timing_results["time_post_processing"] = time.time() - time_model_call_end
@@ -7,9 +7,13 @@ The original LocalRetro code is released under the Apache 2.0 license.
 Parts of this file are based on code from the GitHub repository above.
 """
 
+import multiprocessing
 import sys
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, List, Union
+from typing import Any, List, Tuple, Union
+
+from more_itertools import chunked
 
 from syntheseus.interface.models import BackwardPredictionList, BackwardReactionModel
 from syntheseus.interface.molecule import Molecule
@@ -20,15 +24,130 @@ from syntheseus.reaction_prediction.utils.inference import (
 )
 from syntheseus.reaction_prediction.utils.misc import suppress_outputs
 
+# State used by `_featurize`; this is set once per process (including pool workers).
+_smiles_to_bigraph: Any = None
+_node_featurizer: Any = None
+_edge_featurizer: Any = None
+
+
+def _init_featurizers(node_featurizer: Any, edge_featurizer: Any) -> None:
+    from dgllife.utils import smiles_to_bigraph
+
+    global _smiles_to_bigraph, _node_featurizer, _edge_featurizer
+    _smiles_to_bigraph = smiles_to_bigraph
+    _node_featurizer, _edge_featurizer = node_featurizer, edge_featurizer
+
+
+def _featurize(smiles: str) -> Any:
+    return _smiles_to_bigraph(
+        smiles,
+        node_featurizer=_node_featurizer,
+        edge_featurizer=_edge_featurizer,
+        add_self_loop=True,
+        canonical_atom_order=False,
+    )
+
+
+def _select_top_edits(
+    atom_scores: Any, bond_scores: Any, num_nodes: Any, num_edges: Any, num_results: int
+) -> List[Tuple[List[str], List[Tuple[int, int]], List[float]]]:
+    """Batched version of LocalRetro's `combined_edit`.
+
+    For each graph, selects the `num_results` highest scoring edits across both its atoms and bonds,
+    where an edit is a pair of an atom or bond and a template other than the "no edit" template 0.
+    The selection runs on the device holding the scores, and only the selected edits are moved to
+    CPU. Outputs are in the same format as the ones returned by `combined_edit`.
+    """
+    import torch
+
+    device = atom_scores.device
+    num_graphs = len(num_nodes)
+    graph_idxs = torch.arange(num_graphs, device=device)
+
+    candidate_scores, candidate_sites, candidate_templates, candidate_graphs = [], [], [], []
+    for scores, sizes in [(atom_scores, num_nodes), (bond_scores, num_edges)]:
+        # Narrow down to the top templates for each atom (or bond) first.
+        k = min(num_results, scores.shape[1] - 1)
+        top_scores, top_templates = torch.topk(scores[:, 1:], k=k, dim=1)
+
+        # Sites are indexed locally within each graph.
+        row_graphs = torch.repeat_interleave(graph_idxs, sizes)
+        row_sites = (
+            torch.arange(len(row_graphs), device=device)
+            - (torch.cumsum(sizes, 0) - sizes)[row_graphs]
+        )
+
+        candidate_scores.append(top_scores.flatten())
+        candidate_sites.append(torch.repeat_interleave(row_sites, k))
+        candidate_templates.append(top_templates.flatten() + 1)
+        candidate_graphs.append(torch.repeat_interleave(row_graphs, k))
+
+    num_atom_candidates = len(candidate_scores[0])
+    scores = torch.cat(candidate_scores)
+    graphs = torch.cat(candidate_graphs)
+
+    # Sort by score, then (stably) by graph, so that each graph's candidates end up contiguous and
+    # in decreasing order of score; then keep the first `num_results` from each graph.
+    order = torch.argsort(scores, descending=True)
+    order = order[torch.sort(graphs[order], stable=True).indices]
+
+    counts = torch.bincount(graphs, minlength=num_graphs)
+    ranks = (
+        torch.arange(len(order), device=device) - (torch.cumsum(counts, 0) - counts)[graphs[order]]
+    )
+    selected = order[ranks < num_results]
+
+    # Transfer the selected edits to CPU (with a single copy for all the integer-valued fields), and
+    # split them up by graph. As edits are sorted by graph, each graph's edits form a contiguous span.
+    is_bond, sites, templates = torch.stack(
+        [
+            (selected >= num_atom_candidates).long(),
+            torch.cat(candidate_sites)[selected],
+            torch.cat(candidate_templates)[selected],
+        ]
+    ).tolist()
+    selected_scores = scores[selected].tolist()
+    types = ["b" if flag else "a" for flag in is_bond]
+
+    top_edits: List[Tuple[List[str], List[Tuple[int, int]], List[float]]] = []
+    end = 0
+    for count in torch.bincount(graphs[selected], minlength=num_graphs).tolist():
+        start, end = end, end + count
+        top_edits.append(
+            (
+                types[start:end],
+                list(zip(sites[start:end], templates[start:end])),
+                selected_scores[start:end],
+            )
+        )
+
+    return top_edits
+
 
 class LocalRetroModel(BackwardReactionModel):
-    def __init__(self, model_dir: Union[str, Path], device: str = "cuda:0") -> None:
+    def __init__(
+        self,
+        model_dir: Union[str, Path],
+        device: str = "cuda:0",
+        num_processes: int = 0,
+        chunksize: int = 8,
+        graph_cache_size: int = 10_000,
+        max_batch_size: int = 64,
+    ) -> None:
         """Initializes the LocalRetro model wrapper.
 
         Assumed format of the model directory:
         - `model_dir` contains the model checkpoint as the only `*.pth` file
         - `model_dir` contains the config as the only `*.json` file
         - `model_dir/data` contains `*.csv` data files needed by LocalRetro
+
+        Featurization of input molecules is spread across `num_processes` worker processes (or done
+        in the main process if `num_processes` is 0 or the batch fits in a single `chunksize`). The
+        workers are released by `close()`, which is also called when the model is used as a context
+        manager.
+        Featurized graphs for the `graph_cache_size` most recently seen SMILES are kept around, as
+        the same molecules tend to be queried repeatedly during search. Inputs are passed through
+        the model in batches of at most `max_batch_size`, which bounds the peak memory usage.
         """
 
         import LocalRetro
@@ -38,8 +157,14 @@ class LocalRetroModel(BackwardReactionModel):
         sys.path.insert(0, get_module_path(LocalRetro))
         sys.path.insert(0, get_module_path(scripts))
 
+        from LocalRetro.LocalTemplate.template_decoder import decode_localtemplate, read_prediction
         from LocalRetro.Retrosynthesis import load_templates
-        from LocalRetro.scripts.utils import init_featurizer, load_model
+        from LocalRetro.scripts.utils import collate_molgraphs_test, init_featurizer, load_model
+
+        # Keep references to the functions used during inference, so that these are resolved once.
+        self._collate_molgraphs_test = collate_molgraphs_test
+        self._decode_localtemplate = decode_localtemplate
+        self._read_prediction = read_prediction
 
         data_dir = Path(model_dir) / "data"
         self.args = init_featurizer(
@@ -53,8 +178,29 @@ class LocalRetroModel(BackwardReactionModel):
             }
         )
 
+        _init_featurizers(self.args["node_featurizer"], self.args["edge_featurizer"])
+
+        # Start the workers before the model is loaded, so that they are not forked from a process
+        # which has already initialized CUDA.
+        self.chunksize = chunksize
+        self._featurization_pool = (
+            multiprocessing.Pool(
+                num_processes,
+                initializer=_init_featurizers,
+                initargs=(self.args["node_featurizer"], self.args["edge_featurizer"]),
+            )
+            if num_processes > 0
+            else None
+        )
+
+        self.max_batch_size = max_batch_size
+
+        self._graph_cache_size = graph_cache_size
+        self._graph_cache: "OrderedDict[str, Any]" = OrderedDict()
+
         with suppress_outputs():
             self.model = load_model(self.args)
+        self.model.eval()
 
         [
             self.args["atom_templates"],
@@ -62,87 +208,153 @@ class LocalRetroModel(BackwardReactionModel):
             self.args["template_infos"],
         ] = load_templates(self.args)
 
+        # Templates in the form expected by `decode_localtemplate`, formatted once upfront instead of
+        # for every predicted edit.
+        self._local_templates = {
+            template: ">>".join(f"({smarts})" for smarts in template.split("_")[0].split(">>"))
+            for templates in [self.args["atom_templates"], self.args["bond_templates"]]
+            for template in templates.values()
+        }
+
     def get_parameters(self):
         return self.model.parameters()
 
+    def close(self) -> None:
+        """Shuts down the featurization worker processes (if any)."""
+        # The pool may not exist if `__init__` failed early.
+        pool = getattr(self, "_featurization_pool", None)
+        if pool is not None:
+            pool.terminate()
+            self._featurization_pool = None
+
+    def __enter__(self) -> "LocalRetroModel":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+    def _featurize_all(self, smiles: List[str]) -> List[Any]:
+        if self._featurization_pool is not None and len(smiles) > self.chunksize:
+            return self._featurization_pool.map(_featurize, smiles, chunksize=self.chunksize)
+        else:
+            return list(map(_featurize, smiles))
+
     def _mols_to_batch(self, mols: List[Molecule]) -> Any:
-        from dgllife.utils import smiles_to_bigraph
-        from LocalRetro.scripts.utils import collate_molgraphs_test
-
-        graphs = [
-            smiles_to_bigraph(
-                mol.smiles,
-                node_featurizer=self.args["node_featurizer"],
-                edge_featurizer=self.args["edge_featurizer"],
-                add_self_loop=True,
-                canonical_atom_order=False,
+        smiles = [mol.smiles for mol in mols]
+
+        # Mark cached graphs as recently used, then featurize the (deduplicated) remaining ones.
+        for s in smiles:
+            if s in self._graph_cache:
+                self._graph_cache.move_to_end(s)
+
+        smiles_to_featurize = list(dict.fromkeys(s for s in smiles if s not in self._graph_cache))
+        self._graph_cache.update(zip(smiles_to_featurize, self._featurize_all(smiles_to_featurize)))
+
+        # The cached graphs are safe to share, as `dgl.batch` copies the features into a new graph.
+        graphs = [self._graph_cache[s] for s in smiles]
+
+        while len(self._graph_cache) > self._graph_cache_size:
+            self._graph_cache.popitem(last=False)
+
+        batch = self._collate_molgraphs_test([(None, graph, None) for graph in graphs])[1]
+        return batch.to(self.args["device"])
+
+    def _decode_edits(
+        self, smiles: str, pred_types: List[str], pred_sites: List[Any], pred_scores: List[float]
+    ) -> Tuple[List[str], List[float]]:
+        """Apply the predicted templates to the product to obtain unique reactant SMILES."""
+        outputs: List[str] = []
+        scores: List[float] = []
+
+        for pred_type, (pred_site, pred_template_class), pred_score in zip(
+            pred_types, pred_sites, pred_scores
+        ):
+            mol, site, template, template_info, _ = self._read_prediction(
+                smiles,
+                (pred_type, pred_site, pred_template_class, pred_score),
+                self.args["atom_templates"],
+                self.args["bond_templates"],
+                self.args["template_infos"],
+                raw=True,
             )
-            for mol in mols
-        ]
+            local_template = self._local_templates[template]
+
+            try:
+                decoded_smiles = self._decode_localtemplate(
+                    mol, site, local_template, template_info
+                )
+            except Exception:
+                # Same as in the original LocalRetro code, edits that fail to apply are skipped.
+                continue
+
+            if decoded_smiles is None or decoded_smiles in outputs:
+                continue
 
-        return collate_molgraphs_test([(None, graph, None) for graph in graphs])[1]
+            outputs.append(decoded_smiles)
+            scores.append(float(pred_score))
+
+        return outputs, scores
 
     def _build_batch_predictions(
         self, batch, num_results, inputs, batch_atom_logits, batch_bond_logits
     ):
-        from LocalRetro.scripts.Decode_predictions import get_k_predictions
-        from LocalRetro.scripts.get_edit import combined_edit, get_bg_partition
-
-        graphs, nodes_sep, edges_sep = get_bg_partition(batch)
-        start_node = 0
-        start_edge = 0
-
-        self.args["top_k"] = num_results
-        self.args["raw_predictions"] = []
-
-        for input, graph, end_node, end_edge in zip(inputs, graphs, nodes_sep, edges_sep):
-            pred_types, pred_sites, pred_scores = combined_edit(
-                graph,
-                batch_atom_logits[start_node:end_node],
-                batch_bond_logits[start_edge:end_edge],
-                num_results,
-            )
-            start_node, start_edge = end_node, end_edge
-
-            raw_predictions = [
-                f"({pred_types[i]}, {pred_sites[i][0]}, {pred_sites[i][1]}, {pred_scores[i]:.3f})"
-                for i in range(num_results)
-            ]
-
-            self.args["raw_predictions"].append([input.smiles] + raw_predictions)
+        # Bond outputs correspond to edges other than the self-loops.
+        graph = batch.remove_self_loop()
+        top_edits = _select_top_edits(
+            batch_atom_logits,
+            batch_bond_logits,
+            graph.batch_num_nodes(),
+            graph.batch_num_edges(),
+            num_results,
+        )
 
         batch_predictions = []
-        for idx, input in enumerate(inputs):
-            # We have to `eval` the predictions as they come rendered into strings. Second tuple
-            # component is empirically (on USPTO-50K test set) in [0, 1], resembling a probability,
-            # but does not sum up to 1.0 (usually to something in [0.5, 2.0]).
-            raw_results = list(map(eval, get_k_predictions(test_id=idx, args=self.args)[1][0]))
-
-            if raw_results:
-                raw_outputs, probabilities = zip(*raw_results)
-            else:
-                raw_outputs = probabilities = []
+        for input, (pred_types, pred_sites, pred_scores) in zip(inputs, top_edits):
+            # Scores are log-probabilities of the individual edits. Their exponents are empirically
+            # (on USPTO-50K test set) in [0, 1], resembling a probability of the prediction, but do
+            # not sum up to 1.0 (usually to something in [0.5, 2.0]).
+            raw_outputs, log_probs = self._decode_edits(
+                input.smiles, pred_types, pred_sites, pred_scores
+            )
 
             batch_predictions.append(
                 process_raw_smiles_outputs(
                     input=input,
                     output_list=raw_outputs,
-                    kwargs_list=[{"probability": probability} for probability in probabilities],
+                    kwargs_list=[{"log_prob": log_prob} for log_prob in log_probs],
                 )
             )
 
         return batch_predictions
 
-    def __call__(self, inputs: List[Molecule], num_results: int) -> List[BackwardPredictionList]:
+    def _get_batch_predictions(
+        self, inputs: List[Molecule], num_results: int
+    ) -> List[BackwardPredictionList]:
         import torch
-        from LocalRetro.scripts.utils import predict
 
         batch = self._mols_to_batch(inputs)
-        batch_atom_logits, batch_bond_logits, _ = predict(self.args, self.model, batch)
 
-        batch_atom_logits = torch.nn.Softmax(dim=1)(batch_atom_logits)
-        batch_bond_logits = torch.nn.Softmax(dim=1)(batch_bond_logits)
+        with torch.inference_mode():
+            # Features are already on the device, so LocalRetro's `predict` is not needed.
+            batch_atom_logits, batch_bond_logits, _ = self.model(
+                batch, batch.ndata["h"], batch.edata["e"]
+            )
+
+            # Normalize in log space (ranking of the edits is unaffected). The outputs stay on the
+            # device, as only the top edits are moved to CPU.
+            batch_atom_logits = torch.log_softmax(batch_atom_logits, dim=1)
+            batch_bond_logits = torch.log_softmax(batch_bond_logits, dim=1)
 
         return self._build_batch_predictions(
             batch, num_results, inputs, batch_atom_logits, batch_bond_logits
         )
+
+    def __call__(self, inputs: List[Molecule], num_results: int) -> List[BackwardPredictionList]:
+        batch_predictions: List[BackwardPredictionList] = []
+        for inputs_batch in chunked(inputs, self.max_batch_size):
+            batch_predictions.extend(self._get_batch_predictions(inputs_batch, num_results))
+
+        return batch_predictions
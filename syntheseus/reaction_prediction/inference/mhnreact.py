@@ -9,9 +9,9 @@ The original MHNreact code is released under the BSD-2-Clause license.
 import json
 from collections import defaultdict
 from pathlib import Path
-from typing import List, Union
+from typing import List, Sequence, Tuple, TypeVar, Union
 
-import pandas as pd
+import numpy as np
 
 from syntheseus.interface.models import BackwardPredictionList, BackwardReactionModel
 from syntheseus.interface.molecule import Molecule
@@ -21,6 +21,20 @@ from syntheseus.reaction_prediction.utils.inference import (
 )
 from syntheseus.reaction_prediction.utils.misc import cpu_count, suppress_outputs
 
+ResultType = TypeVar("ResultType")
+
+
+def _top_k(
+    results: Sequence[ResultType], probs: np.ndarray, num_results: int
+) -> Tuple[List[ResultType], List[float]]:
+    """Selects the `num_results` most probable results, only fully sorting those."""
+    top_idxs = np.arange(len(probs))
+    if len(probs) > num_results:
+        top_idxs = np.argpartition(-probs, num_results)[:num_results]
+    top_idxs = top_idxs[np.argsort(-probs[top_idxs], kind="stable")]
+
+    return [results[i] for i in top_idxs], probs[top_idxs].tolist()
+
 
 class MHNreactModel(BackwardReactionModel):
     def __init__(
@@ -146,21 +160,10 @@ class MHNreactModel(BackwardReactionModel):
             for k, v in prod_idx_reactants[idx].items():
                 for iv in v:
                     idx_prod_reactants[iv].append(template_scores[idx, k])
-            d2 = {k: sum(v) for k, v in idx_prod_reactants.items()}
-
-            if len(d2) == 0:
-                results = []
-                probs = []
-            else:
-                df_sorted = pd.DataFrame.from_dict(d2, orient="index").sort_values(
-                    0, ascending=False
-                )
-
-                # Limit to `num_results` results.
-                df_sorted = df_sorted.iloc[:num_results, :]
 
-                results = df_sorted.index.tolist()
-                probs = df_sorted.values.ravel().tolist()
+            all_results = list(idx_prod_reactants.keys())
+            all_probs = np.asarray([sum(v) for v in idx_prod_reactants.values()], dtype=float)
+            results, probs = _top_k(all_results, all_probs, num_results)
 
             batch_predictions.append(
                 process_raw_smiles_outputs(
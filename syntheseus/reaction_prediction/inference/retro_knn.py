@@ -4,7 +4,7 @@ Paper: https://arxiv.org/abs/2306.04123
 """
 
 from pathlib import Path
-from typing import List, Union
+from typing import Any, List, Union
 
 import numpy as np
 
@@ -14,22 +14,49 @@ from syntheseus.reaction_prediction.inference.local_retro import LocalRetroModel
 from syntheseus.reaction_prediction.utils.inference import get_unique_file_in_dir
 
 
+def _combine_log_probs(nn_logits: Any, knn_probs: Any, nn_weight: Any) -> Any:
+    """Mixes the LocalRetro and kNN distributions, returning log-probabilities.
+
+    Scores passed into `LocalRetroModel._build_batch_predictions` are expected to be in log space.
+    """
+    import torch
+
+    return torch.log(nn_weight * torch.softmax(nn_logits, dim=1) + (1 - nn_weight) * knn_probs)
+
+
 class RetroKNNModel(LocalRetroModel):
     """Warpper for RetroKNN model."""
 
-    def __init__(self, model_dir: Union[str, Path], device: str = "cuda:0") -> None:
+    def __init__(
+        self,
+        model_dir: Union[str, Path],
+        device: str = "cuda:0",
+        num_processes: int = 0,
+        chunksize: int = 8,
+        graph_cache_size: int = 10_000,
+        max_batch_size: int = 64,
+    ) -> None:
         """Initializes the RetroKNN model wrapper.
 
         Assumed format of the model directory:
         - `model_dir/local_retro` contains the files needed to load the LocalRetro wrapper
         - `model_dir/knn/` contains the adapter checkpoint as the only `*.pt` file
         - `model_dir/knn/datastore` contains the data store files
+
+        Remaining arguments are passed through to `LocalRetroModel`.
         """
         import torch
 
         from syntheseus.reaction_prediction.models.retro_knn import Adapter
 
-        super().__init__(model_dir=Path(model_dir) / "local_retro", device=device)
+        super().__init__(
+            model_dir=Path(model_dir) / "local_retro",
+            device=device,
+            num_processes=num_processes,
+            chunksize=chunksize,
+            graph_cache_size=graph_cache_size,
+            max_batch_size=max_batch_size,
+        )
 
         adapter_chkpt_path = get_unique_file_in_dir(Path(model_dir) / "knn", pattern="*.pt")
         datastore_path = Path(model_dir) / "knn" / "datastore"
@@ -55,11 +82,8 @@ class RetroKNNModel(LocalRetroModel):
     def _forward_localretro(self, bg):
         from LocalRetro.scripts.model_utils import pair_atom_feats, unbatch_feats, unbatch_mask
 
-        bg = bg.to(self.args["device"])
-        node_feats = bg.ndata.pop("h").to(self.args["device"])
-        edge_feats = bg.edata.pop("e").to(self.args["device"])
-
-        node_feats = self.model.mpnn(bg, node_feats, edge_feats)
+        # Unlike in LocalRetro, `bg` is already on the device (see `_mols_to_batch`).
+        node_feats = self.model.mpnn(bg, bg.ndata["h"], bg.edata["e"])
         atom_feats = node_feats
         bond_feats = self.model.linearB(pair_atom_feats(bg, node_feats))
         edit_feats, mask = unbatch_mask(bg, atom_feats, bond_feats)
@@ -71,46 +95,57 @@ class RetroKNNModel(LocalRetroModel):
 
         return atom_outs, bond_outs, atom_feats, bond_feats
 
-    def __call__(self, inputs: List[Molecule], num_results: int) -> List[BackwardPredictionList]:
+    def _get_batch_predictions(
+        self, inputs: List[Molecule], num_results: int
+    ) -> List[BackwardPredictionList]:
         import torch
 
         from syntheseus.reaction_prediction.models.retro_knn import knn_prob
 
         batch = self._mols_to_batch(inputs)
-        (
-            batch_atom_logits,
-            batch_bond_logits,
-            atom_feats,
-            bond_feats,
-        ) = self._forward_localretro(batch)
-        sg = batch.remove_self_loop().to(self.args["device"])
-
-        node_dis, _ = self.atom_store.search(atom_feats, k=32)
-        edge_dis, _ = self.bond_store.search(bond_feats, k=32)
-
-        node_t, node_p, edge_t, edge_p = self.adapter(
-            sg, atom_feats, bond_feats, node_dis, edge_dis
-        )
-
-        batch_atom_prob_nn = torch.nn.Softmax(dim=1)(batch_atom_logits)
-        batch_bond_prob_nn = torch.nn.Softmax(dim=1)(batch_bond_logits)
-
-        atom_output_label = torch.from_numpy(self.raw_data["atom_output_label"]).to(
-            self.args["device"]
-        )
-        bond_output_label = torch.from_numpy(self.raw_data["bond_output_label"]).to(
-            self.args["device"]
-        )
-
-        batch_atom_prob_knn = knn_prob(
-            atom_feats, self.atom_store, atom_output_label, batch_atom_logits.shape[1], 32, node_t
-        )
-        batch_bond_prob_knn = knn_prob(
-            bond_feats, self.bond_store, bond_output_label, batch_bond_logits.shape[1], 32, edge_t
-        )
 
-        batch_atom_logits = node_p * batch_atom_prob_nn + (1 - node_p) * batch_atom_prob_knn
-        batch_bond_logits = edge_p * batch_bond_prob_nn + (1 - edge_p) * batch_bond_prob_knn
+        with torch.inference_mode():
+            (
+                batch_atom_logits,
+                batch_bond_logits,
+                atom_feats,
+                bond_feats,
+            ) = self._forward_localretro(batch)
+            sg = batch.remove_self_loop()
+
+            node_dis, _ = self.atom_store.search(atom_feats, k=32)
+            edge_dis, _ = self.bond_store.search(bond_feats, k=32)
+
+            node_t, node_p, edge_t, edge_p = self.adapter(
+                sg, atom_feats, bond_feats, node_dis, edge_dis
+            )
+
+            atom_output_label = torch.from_numpy(self.raw_data["atom_output_label"]).to(
+                self.args["device"]
+            )
+            bond_output_label = torch.from_numpy(self.raw_data["bond_output_label"]).to(
+                self.args["device"]
+            )
+
+            batch_atom_prob_knn = knn_prob(
+                atom_feats,
+                self.atom_store,
+                atom_output_label,
+                batch_atom_logits.shape[1],
+                32,
+                node_t,
+            )
+            batch_bond_prob_knn = knn_prob(
+                bond_feats,
+                self.bond_store,
+                bond_output_label,
+                batch_bond_logits.shape[1],
+                32,
+                edge_t,
+            )
+
+            batch_atom_logits = _combine_log_probs(batch_atom_logits, batch_atom_prob_knn, node_p)
+            batch_bond_logits = _combine_log_probs(batch_bond_logits, batch_bond_prob_knn, edge_p)
 
         return self._build_batch_predictions(
             batch, num_results, inputs, batch_atom_logits, batch_bond_logits
@@ -133,7 +133,9 @@ class RootAlignedModel(ReactionModel[InputType, OutputType]):
                 self.probability_from_score_temperature * kwargs["score"] / max_possible_total_rr
                 for kwargs in kwargs_list
             ]
-            probabilities = torch.nn.functional.softmax(torch.as_tensor(scaled_scores), dim=-1)
+            probabilities = torch.nn.functional.softmax(
+                torch.as_tensor(scaled_scores), dim=-1
+            ).tolist()
 
             for kwargs, probability in zip(kwargs_list, probabilities):
                 kwargs["probability"] = probability
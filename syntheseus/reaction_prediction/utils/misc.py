@@ -10,7 +10,6 @@ from typing import Any, Dict, Iterable, Iterator, List, Optional
 import numpy as np
 
 from syntheseus.interface.bag import Bag
-from syntheseus.interface.models import Prediction, PredictionList
 from syntheseus.interface.molecule import Molecule
 
 
@@ -45,13 +44,15 @@ def dictify(data: Any) -> Any:
     elif isinstance(data, (List, tuple, Bag)):
         # Captures possible lists of `Prediction`s and lists of `PredictionList`s
         return [dictify(x) for x in data]
-    elif isinstance(data, (PredictionList, Prediction)):
-        return dictify(dict(data))
     elif isinstance(data, dict):
         return {k: dictify(v) for k, v in data.items()}
     elif is_dataclass(data):
         result = {}
         for f in fields(data):
+            if not f.init:
+                # Skip fields derived from the other ones, as these cannot be passed back in.
+                continue
+
             value = getattr(data, f.name)
             result[f.name] = dictify(value)
         return result
@@ -1,14 +1,50 @@
 import math
 
 import numpy as np
+import pytest
 
-from syntheseus.interface.models import Prediction
+from syntheseus.interface.bag import Bag
+from syntheseus.interface.models import Prediction, PredictionList
+from syntheseus.interface.molecule import Molecule
 
-# TODO(kmaziarz): Currently this test mostly checks that importing from `models.py` works, and that
-# a `Prediction` object can be instantiated. We should extend it later.
 
+@pytest.fixture
+def mol() -> Molecule:
+    return Molecule("CC")
 
-def test_prediction():
-    prediction = Prediction(probability=0.5)
+
+def test_prediction(mol: Molecule) -> None:
+    prediction = Prediction(input=mol, output=Bag([mol]), probability=0.5)
+    assert np.isclose(prediction.get_prob(), 0.5)
+    assert np.isclose(prediction.get_log_prob(), math.log(0.5))
+
+    prediction = Prediction(input=mol, output=Bag([mol]), log_prob=math.log(0.5))
     assert np.isclose(prediction.get_prob(), 0.5)
     assert np.isclose(prediction.get_log_prob(), math.log(0.5))
+
+    prediction = Prediction(input=mol, output=Bag([mol]), probability=0.0)
+    assert prediction.get_log_prob() == -math.inf
+
+    prediction = Prediction(input=mol, output=Bag([mol]))
+    for get_fn in [prediction.get_prob, prediction.get_log_prob]:
+        with pytest.raises(ValueError):
+            get_fn()
+
+    with pytest.raises(ValueError):
+        Prediction(input=mol, output=Bag([mol]), probability=0.5, log_prob=math.log(0.5))
+
+
+def test_prediction_list_truncated(mol: Molecule) -> None:
+    prediction_list = PredictionList(
+        input=mol,
+        predictions=[Prediction(input=mol, output=Bag([mol]), score=idx) for idx in range(5)],
+        metadata={"key": "value"},
+    )
+    truncated = prediction_list.truncated(num_results=2)
+
+    assert truncated.input == mol
+    assert [prediction.score for prediction in truncated.predictions] == [0, 1]
+    assert truncated.metadata == {"key": "value"}
+
+    # The original list should be left unchanged.
+    assert len(prediction_list.predictions) == 5
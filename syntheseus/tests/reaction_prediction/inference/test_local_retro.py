@@ -0,0 +1,119 @@
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, List, Tuple
+
+import pytest
+
+from syntheseus.interface.molecule import Molecule
+from syntheseus.reaction_prediction.inference.local_retro import LocalRetroModel, _select_top_edits
+
+
+class DummyBatch:
+    def __init__(self, graphs: List[Any]) -> None:
+        self.graphs = graphs
+
+    def to(self, device: str) -> "DummyBatch":
+        return self
+
+
+def test_close() -> None:
+    model = object.__new__(LocalRetroModel)
+    model._featurization_pool = multiprocessing.Pool(1)
+
+    with model as entered_model:
+        assert entered_model is model
+
+    # Exiting the context should shut down the workers.
+    assert model._featurization_pool is None
+
+
+def test_mols_to_batch_graph_cache() -> None:
+    # Set up only the state used by `_mols_to_batch`, without loading LocalRetro.
+    model = object.__new__(LocalRetroModel)
+    model.args = {"device": "cpu"}
+    model._graph_cache_size = 3
+    model._graph_cache = OrderedDict()
+    model._collate_molgraphs_test = lambda data: (None, DummyBatch([graph for _, graph, _ in data]))
+
+    featurized: List[List[str]] = []
+
+    def featurize_all(smiles: List[str]) -> List[str]:
+        featurized.append(smiles)
+        return [f"graph_{s}" for s in smiles]
+
+    model._featurize_all = featurize_all  # type: ignore
+
+    def mols_to_batch(smiles: List[str]) -> List[Any]:
+        return model._mols_to_batch([Molecule(s) for s in smiles]).graphs
+
+    # Duplicates within a batch should only be featurized once.
+    assert mols_to_batch(["C", "CC", "C"]) == ["graph_C", "graph_CC", "graph_C"]
+    assert featurized == [["C", "CC"]]
+
+    # Cache hits should not be featurized again, but marked as recently used.
+    assert mols_to_batch(["CCC", "C"]) == ["graph_CCC", "graph_C"]
+    assert featurized[1:] == [["CCC"]]
+    assert list(model._graph_cache) == ["CC", "C", "CCC"]
+
+    # Adding new graphs should evict the least recently used ones.
+    assert mols_to_batch(["CCCC", "C"]) == ["graph_CCCC", "graph_C"]
+    assert featurized[2:] == [["CCCC"]]
+    assert list(model._graph_cache) == ["CCC", "C", "CCCC"]
+
+
+def select_top_edits_reference(
+    atom_scores, bond_scores, num_nodes: List[int], num_edges: List[int], num_results: int
+) -> List[Tuple[List[str], List[Tuple[int, int]], List[float]]]:
+    """Straightforward per-graph version of `_select_top_edits`, enumerating all edits."""
+    atom_offset, bond_offset = 0, 0
+    top_edits = []
+    for graph_num_nodes, graph_num_edges in zip(num_nodes, num_edges):
+        candidates = []
+        for edit_type, scores, offset, size in [
+            ("a", atom_scores, atom_offset, graph_num_nodes),
+            ("b", bond_scores, bond_offset, graph_num_edges),
+        ]:
+            for site in range(size):
+                for template in range(1, scores.shape[1]):  # Template 0 means "no edit".
+                    candidates.append(
+                        (scores[offset + site, template].item(), edit_type, site, template)
+                    )
+
+        atom_offset += graph_num_nodes
+        bond_offset += graph_num_edges
+
+        candidates = sorted(candidates, reverse=True)[:num_results]
+        top_edits.append(
+            (
+                [edit_type for _, edit_type, _, _ in candidates],
+                [(site, template) for _, _, site, template in candidates],
+                [score for score, _, _, _ in candidates],
+            )
+        )
+
+    return top_edits
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("num_results", [1, 5, 1000])
+def test_select_top_edits(seed: int, num_results: int) -> None:
+    torch = pytest.importorskip("torch")
+    generator = torch.Generator().manual_seed(seed)
+
+    num_graphs = int(torch.randint(1, 5, (1,), generator=generator))
+    num_nodes = torch.randint(1, 6, (num_graphs,), generator=generator)
+
+    # Some graphs have no bonds.
+    num_edges = torch.randint(0, 4, (num_graphs,), generator=generator)
+
+    if seed == 0:
+        num_edges = torch.zeros_like(num_edges)  # No bonds in the entire batch.
+
+    atom_scores = torch.randn(int(num_nodes.sum()), 4, generator=generator)
+    bond_scores = torch.randn(int(num_edges.sum()), 3, generator=generator)
+
+    assert _select_top_edits(
+        atom_scores, bond_scores, num_nodes, num_edges, num_results
+    ) == select_top_edits_reference(
+        atom_scores, bond_scores, num_nodes.tolist(), num_edges.tolist(), num_results
+    )
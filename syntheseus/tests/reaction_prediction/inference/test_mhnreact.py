@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from syntheseus.reaction_prediction.inference.mhnreact import _top_k
+
+
+@pytest.mark.parametrize("num_candidates", [0, 3, 5, 20])
+def test_top_k(num_candidates: int) -> None:
+    num_results = 5
+
+    results = [f"result_{idx}" for idx in range(num_candidates)]
+    probs = np.random.default_rng(num_candidates).random(num_candidates)
+
+    expected = sorted(zip(probs.tolist(), results), reverse=True)[:num_results]
+    assert _top_k(results, probs, num_results) == (
+        [result for _, result in expected],
+        [prob for prob, _ in expected],
+    )
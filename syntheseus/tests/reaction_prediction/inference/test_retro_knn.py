@@ -0,0 +1,22 @@
+import math
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from syntheseus.reaction_prediction.inference.retro_knn import _combine_log_probs  # noqa: E402
+
+
+def test_combine_log_probs() -> None:
+    nn_logits = torch.tensor([[0.0, 1.0, 2.0], [3.0, 0.0, 0.0]])
+    knn_probs = torch.tensor([[0.3, 0.7, 0.0], [0.0, 0.0, 1.0]])
+    nn_weight = torch.tensor([[0.0], [0.5]])
+
+    log_probs = _combine_log_probs(nn_logits, knn_probs, nn_weight)
+
+    # With no weight on LocalRetro, the kNN probabilities should be returned (in log space).
+    assert torch.allclose(log_probs[0, :2], torch.tensor([math.log(0.3), math.log(0.7)]))
+    assert log_probs[0, 2] == -math.inf
+
+    expected_probs = 0.5 * torch.softmax(nn_logits[1], dim=0) + 0.5 * knn_probs[1]
+    assert torch.allclose(log_probs[1].exp(), expected_probs)